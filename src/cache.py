@@ -0,0 +1,68 @@
+import json
+import sqlite3
+import numpy as np
+import google.generativeai as genai
+
+# --- 사연/대본 시맨틱 캐시 ---
+# 고민 문장의 임베딩을 키로 생성된 사연과 대본을 저장해 두고,
+# 비슷한 고민이 다시 들어오면 Gemini 호출 없이 저장된 결과를 재사용합니다.
+
+CACHE_DB_PATH = ".story_cache.db"
+EMBEDDING_MODEL = "models/text-embedding-004"
+# 코사인 유사도가 이 값보다 크면 같은 고민으로 간주
+SIMILARITY_THRESHOLD = 0.9
+
+def connect():
+    """캐시 DB에 연결하고 테이블이 없으면 생성합니다."""
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS story_cache ("
+        "concern TEXT NOT NULL, "
+        "embedding BLOB NOT NULL, "
+        "story_json TEXT NOT NULL, "
+        "script_json TEXT NOT NULL)"
+    )
+    return conn
+
+def embed_concern(concern):
+    """고민 문장을 임베딩하여 정규화된 float32 벡터로 반환합니다."""
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=concern)
+    embedding = np.asarray(result["embedding"], dtype=np.float32)
+    # 미리 정규화해 두면 코사인 유사도가 내적 한 번으로 계산됨
+    return embedding / np.linalg.norm(embedding)
+
+def find_similar(embedding):
+    """가장 비슷한 고민의 (사연, 대본, 유사도)를 반환합니다. 임계값을 넘는 항목이 없으면 None."""
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT embedding, story_json, script_json FROM story_cache").fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return None
+
+    matrix = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+    similarities = matrix @ embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] <= SIMILARITY_THRESHOLD:
+        return None
+
+    _, story_json, script_json = rows[best]
+    return json.loads(story_json), json.loads(script_json), float(similarities[best])
+
+def save(concern, embedding, story_data, script):
+    """고민 임베딩과 생성된 사연/대본을 캐시에 저장합니다."""
+    conn = connect()
+    try:
+        conn.execute(
+            "INSERT INTO story_cache (concern, embedding, story_json, script_json) VALUES (?, ?, ?, ?)",
+            (
+                concern,
+                embedding.astype(np.float32).tobytes(),
+                json.dumps(story_data, ensure_ascii=False),
+                json.dumps(script, ensure_ascii=False),
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
@@ -2,14 +2,34 @@
 
 import os
 import json
+import argparse
+import tracemalloc
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import time
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
 import google.generativeai as genai
-from elevenlabs import ElevenLabs, Voice, VoiceSettings
 from pydub import AudioSegment
 from dotenv import load_dotenv
 
+# orjson이 설치되어 있으면 Gemini 응답 파싱과 요청 본문 직렬화에 사용
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# PyAV가 설치되어 있으면 ffmpeg 프로세스를 띄우지 않고 프로세스 내에서 MP3를 디코딩
+try:
+    import av
+except ImportError:
+    av = None
+
 # --- 설정 (Configuration) ---
 
 # .env 파일에서 환경 변수 로드
@@ -37,21 +57,123 @@ SFX_PATH = "sfx"
 GENERATED_AUDIO_PATH = "generated_audio"
 FINAL_PODCAST_PATH = "final_podcast"
 AUTH_FILE_PATH = "auth.txt"
+TOKEN_CACHE_PATH = ".token_cache.json"
+TTS_CACHE_DIR = ".tts_cache"
+PROFILE_LOG_PATH = "profile.jsonl"
+
+# 디버깅용: 생성된 세그먼트 오디오를 GENERATED_AUDIO_PATH에 WAV로 저장
+DEBUG_SAVE_SEGMENTS = os.getenv("DEBUG_SAVE_SEGMENTS") == "1"
 
 # 계정 로테이션 관련 전역 변수
 accounts = []
 current_account_index = 0
 tts_request_count = 0
 current_token = None
+# 오류가 없어도 계정당 이 횟수만큼 TTS 요청을 보내면 다음 계정으로 전환
+MAX_TTS_REQUESTS_PER_ACCOUNT = 10
+# 계정별 Firebase 토큰 캐시: {email: [token, 만료 시각(epoch 초)]}
+token_cache = {}
+# 여러 TTS 작업 스레드가 계정/토큰 전역 변수를 공유하므로 잠금으로 보호
+account_lock = threading.Lock()
+
+# --profile 실행 시 단계별 소요 시간(ms)을 모아 PROFILE_LOG_PATH에 기록
+profiling_enabled = False
+profile_data = {}
+profile_lock = threading.Lock()
+
+# 동시에 처리할 TTS 요청 수 (ElevenLabs 동시 요청 제한에 맞춰 .env에서 조정 가능)
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "4"))
+
+# 한 번의 text-to-dialogue 요청에 묶어 보낼 최대 대사 수 (1이면 대사마다 개별 요청)
+TTS_BATCH_SIZE = int(os.getenv("TTS_BATCH_SIZE", "1"))
+# 묶음 요청 결과를 대사별로 나눌 때 무음으로 판단할 음량과 최소 길이
+SILENCE_THRESHOLD_DBFS = -45
+MIN_SILENCE_GAP_MS = 150
+
+# 최종 MP3 비트레이트 (mono 음성 팟캐스트에 충분한 품질)
+EXPORT_MP3_BITRATE = "96k"
+
+# ElevenLabs 스트리밍 지연 최적화 단계 (0: 끔 ~ 4: 최대)
+TTS_STREAMING_LATENCY = 3
+
+# ElevenLabs에 MP3 대신 16비트 mono PCM을 요청하여 디코딩 과정을 생략
+# (pcm_44100은 유료 플랜 전용이므로 모든 계정에서 사용 가능한 24kHz 사용)
+TTS_SAMPLE_RATE = 24000
+TTS_OUTPUT_FORMAT = f"pcm_{TTS_SAMPLE_RATE}"
+
+# Firebase/ElevenLabs 요청이 TCP/TLS 연결을 재사용하도록 세션을 공유
+# 호스트별로 모든 작업 스레드가 각자 연결을 유지할 수 있도록 풀 크기를 맞춤
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TTS_MAX_WORKERS, max_retries=0))
+
+# --- JSON 처리 ---
+
+def json_loads(text):
+    """JSON 문자열/바이트를 파싱합니다. orjson이 있으면 orjson을 사용합니다."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def json_dumps(obj):
+    """객체를 UTF-8 JSON 바이트로 직렬화합니다. orjson이 있으면 orjson을 사용합니다."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+# --- 프로파일링 ---
+
+def record_timing(name, started):
+    """프로파일링 중이면 started(perf_counter 값)부터 지금까지의 시간을 ms 단위로 기록합니다."""
+    if not profiling_enabled:
+        return
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    with profile_lock:
+        profile_data.setdefault(name, []).append(elapsed_ms)
+
+def write_profile():
+    """수집한 프로파일링 결과를 PROFILE_LOG_PATH에 JSON 한 줄로 추가합니다."""
+    record = {"timestamp": time.time(), **profile_data}
+    with open(PROFILE_LOG_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"⏱️ 프로파일링 결과를 '{PROFILE_LOG_PATH}'에 기록했습니다.")
 
 # --- 1. 대본 생성 (Gemini) ---
 
+# Gemini 응답을 강제할 대본 JSON 스키마 (화자는 VOICE_MAPPING에 있는 목소리만 허용)
+PODCAST_SCRIPT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "total_duration_seconds": {"type": "NUMBER"},
+        "segments": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "type": {"type": "STRING", "enum": ["dialogue"]},
+                    "speaker": {"type": "STRING", "enum": list(VOICE_MAPPING)},
+                    "text": {"type": "STRING"},
+                    "start_time": {"type": "NUMBER"}
+                },
+                "required": ["type", "speaker", "text", "start_time"]
+            }
+        }
+    },
+    "required": ["title", "total_duration_seconds", "segments"]
+}
+
 def generate_podcast_script(situation):
     """Gemini API를 사용하여 팟캐스트 대본을 생성합니다."""
     print("1. Gemini API를 사용하여 팟캐스트 대본을 생성합니다...")
 
-    # Gemini 모델 설정
-    model = genai.GenerativeModel('gemini-2.5-pro')
+    # Gemini 모델 설정 (마크다운 없이 스키마에 맞는 JSON만 반환하도록 지정)
+    model = genai.GenerativeModel(
+        'gemini-2.5-pro',
+        generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": PODCAST_SCRIPT_SCHEMA
+        }
+    )
 
     # Gemini에게 보낼 프롬프트
     prompt = f"""
@@ -120,10 +242,10 @@ JSON 형식:
 """
 
     try:
+        started = time.perf_counter()
         response = model.generate_content(prompt)
-        # 모델 응답에서 JSON 부분만 추출
-        json_text = response.text.strip().replace("```json", "").replace("```", "")
-        script = json.loads(json_text)
+        record_timing("gemini_ms", started)
+        script = json_loads(response.text)
         print("   - 대본 생성 완료.")
         return script
     except Exception as e:
@@ -173,25 +295,56 @@ def rotate_account():
 
 def should_rotate_account():
     """계정을 로테이션해야 하는지 확인합니다."""
-    return tts_request_count >= 2
+    return tts_request_count >= MAX_TTS_REQUESTS_PER_ACCOUNT
 
 def increment_tts_count():
     """TTS 요청 카운터를 증가시킵니다."""
     global tts_request_count
     tts_request_count += 1
-    print(f"📊 현재 계정 TTS 요청 수: {tts_request_count}/2")
+    print(f"📊 현재 계정 TTS 요청 수: {tts_request_count}/{MAX_TTS_REQUESTS_PER_ACCOUNT}")
+
+def load_token_cache():
+    """디스크에 저장된 Firebase 토큰 캐시를 로드합니다."""
+    global token_cache
+    try:
+        with open(TOKEN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            token_cache = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        token_cache = {}
+
+def save_token_cache():
+    """Firebase 토큰 캐시를 임시 파일에 쓴 뒤 교체하여 원자적으로 저장합니다."""
+    temp_path = f"{TOKEN_CACHE_PATH}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(token_cache, f)
+        os.replace(temp_path, TOKEN_CACHE_PATH)
+    except OSError as e:
+        print(f"⚠️ 토큰 캐시 저장 실패: {e}")
 
 # --- 3. 오디오 생성 및 믹싱 (ElevenLabs & Pydub) ---
 
+# 감정 태그([excited] 등)와 연속 공백 패턴
+EMOTION_TAG_PATTERN = re.compile(r'\[([^\]]+)\]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 안정성 조정에 사용하는 감정 분류
+CREATIVE_EMOTIONS = frozenset({'excited', 'dramatic', 'nervous'})
+ROBUST_EMOTIONS = frozenset({'whispers', 'serious', 'thoughtful'})
+# 파일 이름에 쓸 수 없는 문자(공백, 경로 구분자 등) 패턴
+UNSAFE_FILENAME_PATTERN = re.compile(r'[^\w\-]+')
+
 def extract_emotion_and_text(text):
     """텍스트에서 감정 태그를 추출하고 깨끗한 텍스트를 반환합니다."""
-    # 감정 태그 패턴 매칭
-    emotion_pattern = r'\[([^\]]+)\]'
-    emotions = re.findall(emotion_pattern, text)
-    
-    # 감정 태그 제거하여 깨끗한 텍스트 생성
-    cleaned_text = re.sub(emotion_pattern, '', text)
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+    emotions = []
+
+    def collect_emotion(match):
+        emotions.append(match.group(1))
+        return ''
+
+    # 감정 태그 수집과 제거를 한 번의 탐색으로 처리
+    cleaned_text = EMOTION_TAG_PATTERN.sub(collect_emotion, text)
+    cleaned_text = WHITESPACE_PATTERN.sub(' ', cleaned_text).strip()
     
     return emotions, cleaned_text
 
@@ -211,6 +364,13 @@ def get_firebase_token():
     
     firebase_email = account['email']
     firebase_password = account['password']
+
+    # 캐시된 토큰이 60초 이상 유효하면 로그인 없이 재사용
+    cached = token_cache.get(firebase_email)
+    if cached and cached[1] - time.time() > 60:
+        current_token = cached[0]
+        return current_token
+
     firebase_api_key = os.getenv("FIREBASE_API_KEY")
     
     if not firebase_api_key:
@@ -238,10 +398,17 @@ def get_firebase_token():
     
     for attempt in range(max_retries):
         try:
-            r = requests.post(url, headers=headers, json=payload)
+            started = time.perf_counter()
+            r = SESSION.post(url, headers=headers, data=json_dumps(payload))
+            record_timing("firebase_ms", started)
             if r.status_code == 200:
-                token = r.json()['idToken']
+                data = r.json()
+                token = data['idToken']
                 current_token = token
+                # 토큰 유효 시간(기본 1시간)보다 60초 일찍 만료된 것으로 기록
+                expires_in = int(data.get('expiresIn', 3600))
+                token_cache[firebase_email] = [token, time.time() + expires_in - 60]
+                save_token_cache()
                 print(f"✅ Token OK for {firebase_email}")
                 return token
             else:
@@ -258,72 +425,151 @@ def get_firebase_token():
     print(f"❌ Firebase 인증 실패: {max_retries}회 재시도 후 실패")
     return None
 
-def text_to_speech_v3(text, voice_id, emotions=None):
-    """ElevenLabs v3 API를 사용하여 텍스트를 음성으로 변환합니다. 실패시 3초 대기 후 최대 3회 재시도."""
+def get_tts_cache_path(inputs, stability):
+    """음성 설정과 대사 목록으로 TTS 캐시 파일 경로를 계산합니다."""
+    lines = "|".join(f"{item['voice_id']}|{item['text']}" for item in inputs)
+    key = hashlib.sha256(f"{stability}|{TTS_OUTPUT_FORMAT}|{lines}".encode('utf-8')).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, f"{key}.pcm")
+
+def save_tts_cache(cache_path, audio_bytes):
+    """생성된 PCM 오디오를 임시 파일에 쓴 뒤 교체하여 캐시에 저장합니다."""
+    temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(audio_bytes)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️ TTS 캐시 저장 실패: {e}")
+
+def acquire_tts_token():
+    """TTS 요청에 사용할 토큰과 그 계정의 이메일을 가져오고 요청 카운터를 증가시킵니다."""
+    # 여러 스레드가 동시에 호출하므로 로테이션 확인부터 카운터 증가까지 잠금 안에서 처리
+    with account_lock:
+        if should_rotate_account():
+            rotate_account()
+        token = get_firebase_token()
+        if not token:
+            return None, None
+        increment_tts_count()
+        return token, get_current_account()['email']
+
+def handle_rejected_token(token, rotate):
+    """ElevenLabs가 거부한 토큰을 폐기하고, 필요하면 다음 계정으로 전환합니다. 처리 후 현재 계정의 이메일을 반환합니다."""
     global current_token
-    
-    # 계정 로테이션 확인
-    if should_rotate_account():
-        rotate_account()
-    
-    # 토큰 가져오기
-    token = get_firebase_token()
-    if not token:
+    with account_lock:
+        # 다른 스레드가 이미 토큰을 교체했다면 중복으로 처리하지 않음
+        if current_token == token:
+            if rotate:
+                # 할당량 초과: 토큰은 유효하므로 캐시는 유지하고 계정만 전환
+                rotate_account()
+            else:
+                # 토큰 만료: 캐시에서도 제거하고 같은 계정으로 다시 로그인
+                token_cache.pop(get_current_account()['email'], None)
+                save_token_cache()
+                current_token = None
+        return get_current_account()['email']
+
+def get_error_status(r):
+    """ElevenLabs 오류 응답 본문의 detail.status 값(예: quota_exceeded)을 반환합니다."""
+    try:
+        detail = r.json().get("detail")
+    except (ValueError, AttributeError):
         return None
-    
-    url = "https://api.us.elevenlabs.io/v1/text-to-dialogue/stream"
-    
-    # 감정 정보를 바탕으로 설정 조정 (TTD는 0.0, 0.5, 1.0만 허용)
-    stability = 0.5  # Natural (기본값)
+    return detail.get("status") if isinstance(detail, dict) else None
+
+def get_retry_delay(r, default):
+    """Retry-After 헤더가 있으면 그 값(초)을, 없으면 기본 대기 시간을 반환합니다."""
+    try:
+        return max(0, int(r.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+def get_stability(emotions):
+    """감정 태그를 바탕으로 TTD 안정성 값을 정합니다. (TTD는 0.0, 0.5, 1.0만 허용)"""
     if emotions:
         # 감정에 따라 안정성 조정
-        if any(emotion in ['excited', 'dramatic', 'nervous'] for emotion in emotions):
-            stability = 0.0  # Creative (더 다이나믹한 표현)
-        elif any(emotion in ['whispers', 'serious', 'thoughtful'] for emotion in emotions):
-            stability = 1.0  # Robust (더 안정적인 표현)
+        if not CREATIVE_EMOTIONS.isdisjoint(emotions):
+            return 0.0  # Creative (더 다이나믹한 표현)
+        elif not ROBUST_EMOTIONS.isdisjoint(emotions):
+            return 1.0  # Robust (더 안정적인 표현)
+    return 0.5  # Natural (기본값)
+
+def text_to_speech_v3(text, voice_id, emotions=None):
+    """ElevenLabs v3 API를 사용하여 텍스트를 음성으로 변환합니다."""
+    return request_dialogue_audio([{"text": text, "voice_id": voice_id}], get_stability(emotions))
+
+def request_dialogue_audio(inputs, stability):
+    """ElevenLabs text-to-dialogue API로 여러 대사를 이어 붙인 PCM 오디오를 생성합니다. 토큰 만료/할당량 초과 시 재로그인 또는 계정 전환 후 즉시, 그 외 실패시 15초 대기 후 최대 5회 재시도."""
+    url = "https://api.us.elevenlabs.io/v1/text-to-dialogue/stream"
+
+    # 같은 목소리/설정/대사로 생성한 적이 있으면 API 호출 없이 캐시 사용
+    cache_path = get_tts_cache_path(inputs, stability)
+    try:
+        with open(cache_path, "rb") as f:
+            print("💾 TTS 캐시 사용")
+            return f.read()
+    except FileNotFoundError:
+        pass
     
     headers = {
-        "Accept": "audio/mpeg",
+        "Accept": "application/octet-stream",
         "Content-Type": "application/json",
         "Origin": "https://elevenlabs.io",
         "Referer": "https://elevenlabs.io/",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-        "authorization": f"Bearer {token}"
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
     }
     
-    # TTS 요청 카운터 증가
-    increment_tts_count()
-    
     payload = {
-        "inputs": [
-            {
-                "text": text,
-                "voice_id": voice_id
-            }
-        ],
+        "inputs": inputs,
         "model_id": "eleven_v3",
         "settings": {
             "stability": stability,
             "use_speaker_boost": True
         }
     }
+    # 재시도 때마다 다시 직렬화하지 않도록 요청 본문을 미리 생성
+    body = json_dumps(payload)
     
     # 재시도 로직
     max_retries = 5
     retry_delay = 15
+    # 이번 요청에서 할당량 초과/요청 한도로 거부된 계정과 401 후 재로그인한 계정
+    rejected_accounts = set()
+    relogged_in_accounts = set()
     
     for attempt in range(max_retries):
+        # 매 시도마다 토큰을 가져와 로테이션/재로그인 결과를 반영
+        token, email = acquire_tts_token()
+        if not token:
+            return None
+        headers["authorization"] = f"Bearer {token}"
+
         try:
-            print(f"🔊 Sending request to ElevenLabs for voice_id: {voice_id}... (attempt {attempt + 1}/{max_retries})")
-            r = requests.post(url, json=payload, headers=headers, stream=True)
+            started = time.perf_counter()
+            voice_ids = ", ".join(item["voice_id"] for item in inputs)
+            print(f"🔊 Sending request to ElevenLabs for voice_id: {voice_ids}... (attempt {attempt + 1}/{max_retries})")
+            r = SESSION.post(
+                url,
+                params={
+                    "optimize_streaming_latency": TTS_STREAMING_LATENCY,
+                    "output_format": TTS_OUTPUT_FORMAT
+                },
+                data=body,
+                headers=headers,
+                stream=True
+            )
             
             if r.status_code == 200:
-                # 스트리밍 응답을 바이트로 수집
-                audio_bytes = b""
-                for chunk in r.iter_content(4096):
+                # 스트리밍 응답을 도착하는 대로 버퍼에 이어 붙임
+                audio_bytes = bytearray()
+                for chunk in r.iter_content(65536):
                     if chunk:
-                        audio_bytes += chunk
+                        audio_bytes.extend(chunk)
                 print("✅ Audio generated successfully")
+                audio_bytes = bytes(audio_bytes)
+                record_timing("tts_ms", started)
+                save_tts_cache(cache_path, audio_bytes)
                 return audio_bytes
             else:
                 print(f"❌ ElevenLabs error [{r.status_code}]:")
@@ -331,6 +577,26 @@ def text_to_speech_v3(text, voice_id, emotions=None):
                     print(r.json())
                 except json.JSONDecodeError:
                     print(r.text)
+
+                # 토큰 만료(401)는 같은 계정으로 다시 로그인한 뒤 대기 없이 재시도
+                # 단, 문자 할당량 소진(quota_exceeded)이나 재로그인 직후의 401은 계정 문제이므로 전환
+                if (r.status_code == 401 and get_error_status(r) != "quota_exceeded"
+                        and email not in relogged_in_accounts):
+                    handle_rejected_token(token, rotate=False)
+                    relogged_in_accounts.add(email)
+                    continue
+                if r.status_code in (401, 402, 429):
+                    rejected_accounts.add(email)
+                    next_email = handle_rejected_token(token, rotate=True)
+                    # 아직 거부되지 않은 다른 계정으로 넘어갔을 때만 바로 재시도
+                    if next_email not in rejected_accounts:
+                        continue
+                    # 모든 계정이 거부됨: 일시적인 제한이 풀리도록 대기 후 재시도
+                    if attempt < max_retries - 1:
+                        delay = get_retry_delay(r, retry_delay)
+                        print(f"🔄 사용 가능한 계정이 없어 {delay}초 후 재시도... ({attempt + 1}/{max_retries})")
+                        time.sleep(delay)
+                    continue
                 
                 if attempt < max_retries - 1:
                     print(f"🔄 {retry_delay}초 후 재시도... ({attempt + 1}/{max_retries})")
@@ -345,6 +611,239 @@ def text_to_speech_v3(text, voice_id, emotions=None):
     print(f"❌ ElevenLabs API 실패: {max_retries}회 재시도 후 실패")
     return None
 
+def text_to_speech_fallback(text, voice_id):
+    """API 키(xi-api-key)로 ElevenLabs 기본 TTS API를 호출하여 MP3 청크 이터레이터를 반환합니다."""
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+    headers = {
+        "Accept": "audio/mpeg",
+        "Content-Type": "application/json",
+        "xi-api-key": ELEVENLABS_API_KEY
+    }
+    payload = {
+        "text": text,
+        "voice_settings": {
+            "stability": 0.5,
+            "similarity_boost": 0.75,
+            "style": 0.0,
+            "use_speaker_boost": True
+        }
+    }
+    r = SESSION.post(url, data=json_dumps(payload), headers=headers, stream=True)
+    r.raise_for_status()
+    return r.iter_content(65536)
+
+class ChunkReader:
+    """바이트 청크 이터레이터를 파일처럼 읽을 수 있게 감싸는 클래스입니다.
+
+    탐색(seek)이 불가능하므로 PyAV가 LAME/Xing 헤더의 인코더 지연/패딩 정보를 적용하지 못합니다.
+    그래서 gapless 헤더가 있는 MP3는 전체 바이트를 디코딩할 때보다 앞뒤로 수십 ms의 무음이 더 붙을 수 있습니다.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        # 전부 읽기 요청이면 남은 청크를 모두 이어 붙여 반환
+        if size is None or size < 0:
+            data = b"".join([self._buffer, *self._chunks])
+            self._buffer = b""
+            return data
+
+        # 버퍼가 비었을 때만 다음 청크를 받아오므로 다운로드와 디코딩이 번갈아 진행됨
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._buffer = chunk
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def decode_mp3(audio):
+    """MP3 바이트 또는 다운로드 중인 청크 이터레이터를 AudioSegment로 디코딩합니다."""
+    if av is None:
+        if not isinstance(audio, bytes):
+            audio = b"".join(audio)
+        return AudioSegment.from_file(BytesIO(audio), format="mp3")
+
+    # 청크 이터레이터는 받는 대로 디코딩하여 네트워크 대기 시간과 디코딩을 겹침
+    source = BytesIO(audio) if isinstance(audio, bytes) else ChunkReader(audio)
+    with av.open(source, format="mp3") as container:
+        stream = container.streams.audio[0]
+        codec = stream.codec_context
+        # pydub가 그대로 사용할 수 있도록 16비트 interleaved PCM으로 변환
+        resampler = av.AudioResampler(format="s16", layout=codec.layout.name, rate=codec.sample_rate)
+        pcm = bytearray()
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                pcm.extend(resampled.to_ndarray().tobytes())
+        for resampled in resampler.resample(None):
+            pcm.extend(resampled.to_ndarray().tobytes())
+
+    return AudioSegment(
+        data=bytes(pcm),
+        sample_width=2,
+        frame_rate=codec.sample_rate,
+        channels=len(codec.layout.channels)
+    )
+
+def synth_segment(i, segment):
+    """대사 세그먼트 하나를 음성으로 합성하여 (인덱스, 시작 시간(ms), AudioSegment)를 반환합니다."""
+    speaker = segment["speaker"]
+    start_time_ms = segment["start_time"] * 1000
+    # 감정 태그 추출 및 텍스트 정리
+    emotions, cleaned_text = extract_emotion_and_text(segment["text"])
+    voice_id = VOICE_MAPPING[speaker]
+
+    # v3 API 사용하여 감정 표현이 포함된 음성 생성 (raw PCM이므로 디코딩 없이 바로 사용)
+    audio_bytes = text_to_speech_v3(cleaned_text, voice_id, emotions)
+
+    if audio_bytes:
+        speech_segment = AudioSegment(
+            data=audio_bytes,
+            sample_width=2,
+            frame_rate=TTS_SAMPLE_RATE,
+            channels=1
+        )
+    else:
+        # v3 API 실패 시 기존 API로 폴백
+        print(f"   - v3 API 실패, 기존 API로 폴백...")
+        started = time.perf_counter()
+        speech_segment = decode_mp3(text_to_speech_fallback(cleaned_text, voice_id))
+        record_timing("fallback_tts_decode_ms", started)
+
+    save_debug_segment(i, speaker, speech_segment)
+    return i, start_time_ms, speech_segment
+
+def split_dialogue_audio(audio, texts):
+    """여러 대사가 이어진 오디오를 대사별로 나눕니다. 나눌 수 없으면 None을 반환합니다."""
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+    window = audio.frame_rate // 100  # 10ms 단위로 음량 측정
+    windows = len(samples) // window
+    levels = samples[:windows * window].reshape(windows, window).astype(np.float32)
+    rms = np.sqrt(np.mean(levels * levels, axis=1))
+    silent = rms < 32768 * 10 ** (SILENCE_THRESHOLD_DBFS / 20)
+
+    # 무음 구간의 가운데 위치 목록 (앞뒤 가장자리 무음은 대사 경계가 아니므로 제외)
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    gap_centers = [
+        (start + end) // 2
+        for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+        if start > 0 and end < windows and (end - start) * 10 >= MIN_SILENCE_GAP_MS
+    ]
+    if len(gap_centers) < len(texts) - 1:
+        return None
+
+    # 대사 길이(글자 수) 비율로 예상한 경계 위치에 가장 가까운 무음 구간을 순서대로 선택
+    total_chars = sum(len(text) for text in texts)
+    boundaries = []
+    chars_so_far = 0
+    for k, text in enumerate(texts[:-1]):
+        chars_so_far += len(text)
+        expected = windows * chars_so_far / total_chars
+        # 남은 경계 수만큼 무음 구간을 남겨두어야 함
+        remaining = len(texts) - 2 - k
+        candidates = [center for center in gap_centers[:len(gap_centers) - remaining]
+                      if not boundaries or center > boundaries[-1]]
+        if not candidates:
+            return None
+        boundaries.append(min(candidates, key=lambda center: abs(center - expected)))
+
+    cuts = [0, *(boundary * window for boundary in boundaries), len(samples)]
+    return [
+        AudioSegment(
+            data=samples[begin:end].tobytes(),
+            sample_width=2,
+            frame_rate=audio.frame_rate,
+            channels=1
+        )
+        for begin, end in zip(cuts, cuts[1:])
+    ]
+
+def synth_batch(batch):
+    """연속된 대사 세그먼트들을 한 번의 요청으로 합성하여 세그먼트별 결과 목록을 반환합니다."""
+    if len(batch) == 1:
+        return [synth_segment(*batch[0])]
+
+    inputs = []
+    emotions = []
+    for i, segment in batch:
+        segment_emotions, cleaned_text = extract_emotion_and_text(segment["text"])
+        emotions.extend(segment_emotions)
+        inputs.append({"text": cleaned_text, "voice_id": VOICE_MAPPING[segment["speaker"]]})
+
+    # 묶음 안의 대사들은 같은 안정성 값을 갖도록 구성됨
+    audio_bytes = request_dialogue_audio(inputs, get_stability(emotions))
+    pieces = None
+    if audio_bytes:
+        dialogue_audio = AudioSegment(
+            data=audio_bytes,
+            sample_width=2,
+            frame_rate=TTS_SAMPLE_RATE,
+            channels=1
+        )
+        pieces = split_dialogue_audio(dialogue_audio, [item["text"] for item in inputs])
+
+    if not pieces:
+        # 묶음 요청이나 대사 분할에 실패하면 대사별 개별 요청으로 폴백
+        print(f"   - 묶음 음성 생성 실패, 대사별로 다시 생성합니다...")
+        return [synth_segment(i, segment) for i, segment in batch]
+
+    results = []
+    for (i, segment), speech_segment in zip(batch, pieces):
+        save_debug_segment(i, segment["speaker"], speech_segment)
+        results.append((i, segment["start_time"] * 1000, speech_segment))
+    return results
+
+def save_debug_segment(i, speaker, speech_segment):
+    """디버깅 모드에서만 생성된 오디오를 파일로 저장합니다."""
+    if DEBUG_SAVE_SEGMENTS:
+        segment_filename = os.path.join(GENERATED_AUDIO_PATH, f"segment_{i}_{speaker}.wav")
+        speech_segment.export(segment_filename, format="wav")
+
+def mix_segments(placements):
+    """(시작 시간(ms), AudioSegment) 목록을 하나의 numpy 버퍼에 합산하여 믹싱합니다."""
+    # 모든 세그먼트를 TTS 출력과 같은 16비트 mono 포맷으로 통일
+    tracks = []
+    for start_ms, segment in placements:
+        segment = segment.set_frame_rate(TTS_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+        start = int(start_ms * TTS_SAMPLE_RATE / 1000)
+        tracks.append((start, np.frombuffer(segment.raw_data, dtype=np.int16)))
+
+    # 실제 마지막 대사가 끝나는 지점까지만 버퍼 할당
+    total_samples = max(start + len(samples) for start, samples in tracks)
+    mix = np.zeros(total_samples, dtype=np.int32)
+    for start, samples in tracks:
+        # 누적 버퍼 구간에 직접 더해 임시 배열 생성을 피함
+        window = mix[start:start + len(samples)]
+        np.add(window, samples, out=window)
+
+    # 포화 처리도 제자리에서 수행한 뒤 16비트로 한 번만 변환
+    np.clip(mix, -32768, 32767, out=mix)
+    return AudioSegment(
+        data=mix.astype(np.int16).tobytes(),
+        sample_width=2,
+        frame_rate=TTS_SAMPLE_RATE,
+        channels=1
+    )
+
+def export_mp3(audio, output_filename):
+    """PCM 오디오를 임시 WAV 파일 없이 ffmpeg 표준 입력으로 전달하여 MP3로 인코딩합니다."""
+    command = [
+        AudioSegment.converter, "-y",
+        "-f", f"s{audio.sample_width * 8}le",
+        "-ar", str(audio.frame_rate),
+        "-ac", str(audio.channels),
+        "-i", "pipe:0",
+        "-c:a", "libmp3lame",
+        "-b:a", EXPORT_MP3_BITRATE,
+        output_filename
+    ]
+    result = subprocess.run(command, input=audio.raw_data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 인코딩 실패: {result.stderr.decode('utf-8', errors='replace')}")
+
 def create_and_mix_audio(script):
     """대본을 기반으로 오디오를 생성하고 믹싱합니다."""
     if not script:
@@ -352,103 +851,125 @@ def create_and_mix_audio(script):
 
     print("\n2. 대본을 기반으로 오디오를 생성하고 믹싱합니다...")
 
-    # ElevenLabs 클라이언트 인스턴스 생성
-    try:
-        client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    except Exception as e:
-        print(f"   - 에러: ElevenLabs 클라이언트 생성에 실패했습니다. API 키를 확인하세요. ({e})")
-        return
-
     # 폴더 생성
-    os.makedirs(GENERATED_AUDIO_PATH, exist_ok=True)
+    if DEBUG_SAVE_SEGMENTS:
+        os.makedirs(GENERATED_AUDIO_PATH, exist_ok=True)
     os.makedirs(FINAL_PODCAST_PATH, exist_ok=True)
 
-    # 최종 팟캐스트를 위한 빈 오디오 세그먼트 생성 (실제 길이는 동적으로 확장)
-    # 프롬프트의 길이 제한은 가이드일 뿐, 실제 오디오는 끊기지 않도록 처리
-    initial_duration_ms = 300000  # 5분으로 넉넉하게 설정
-    final_podcast = AudioSegment.silent(duration=initial_duration_ms)
-
-    # 대본의 각 세그먼트 처리
-    previous_end_time = 0
-    
-    for i, segment in enumerate(script["segments"]):
-        segment_type = segment["type"]
-        start_time_ms = segment["start_time"] * 1000
-
-        if segment_type == "dialogue":
-            speaker = segment["speaker"]
-            original_text = segment["text"]
-            # 감정 태그 추출 및 텍스트 정리
-            emotions, cleaned_text = extract_emotion_and_text(original_text)
-            voice_id = VOICE_MAPPING.get(speaker)
-            
-            if not voice_id:
-                print(f"   - 경고: '{speaker}'에 해당하는 목소리를 찾을 수 없습니다. 건너뜁니다.")
-                continue
-
-            print(f"   - '{speaker}'의 음성을 생성 중... ({i+1}/{len(script['segments'])})")
-            
+    # 1단계: 안정성 값이 같은 연속 대사를 최대 TTS_BATCH_SIZE개씩 묶음
+    batches = []
+    batch_stability = None
+    segments = script["segments"]
+    total_segments = len(segments)
+    for i, segment in enumerate(segments):
+        if segment["type"] != "dialogue":
+            continue
+
+        speaker = segment["speaker"]
+        if speaker not in VOICE_MAPPING:
+            print(f"   - 경고: '{speaker}'에 해당하는 목소리를 찾을 수 없습니다. 건너뜁니다.")
+            continue
+
+        print(f"   - '{speaker}'의 음성을 생성 중... ({i+1}/{total_segments})")
+        stability = get_stability(extract_emotion_and_text(segment["text"])[0])
+        if not batches or len(batches[-1]) >= TTS_BATCH_SIZE or stability != batch_stability:
+            batches.append([])
+            batch_stability = stability
+        batches[-1].append((i, segment))
+
+    # 2단계: 모든 묶음의 음성을 병렬로 생성
+    results = []
+    with ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as executor:
+        futures = [executor.submit(synth_batch, batch) for batch in batches]
+
+        for future in futures:
             try:
-                # v3 API 사용하여 감정 표현이 포함된 음성 생성
-                audio_bytes = text_to_speech_v3(cleaned_text, voice_id, emotions)
-                
-                if not audio_bytes:
-                    # v3 API 실패 시 기존 API로 폴백
-                    print(f"   - v3 API 실패, 기존 API로 폴백...")
-                    audio_stream = client.text_to_speech.convert(
-                        voice_id=voice_id,
-                        text=cleaned_text,
-                        voice_settings=VoiceSettings(
-                            stability=0.5, 
-                            similarity_boost=0.75, 
-                            style=0.0, 
-                            use_speaker_boost=True
-                        )
-                    )
-                    audio_bytes = b"".join(audio_stream)
-                
-                # 생성된 오디오를 파일로 저장하고 Pydub로 로드
-                segment_filename = os.path.join(GENERATED_AUDIO_PATH, f"segment_{i}_{speaker}.mp3")
-                with open(segment_filename, "wb") as f:
-                    f.write(audio_bytes)
-                
-                speech_segment = AudioSegment.from_mp3(segment_filename)
-                
-                # 겹침 방지: 이전 대사가 끝나는 시점 이후에 배치
-                adjusted_start_time = max(start_time_ms, previous_end_time + 500)  # 0.5초 간격
-                final_podcast = final_podcast.overlay(speech_segment, position=adjusted_start_time)
-                
-                # 다음 대사를 위한 종료 시점 계산
-                previous_end_time = adjusted_start_time + len(speech_segment)
-
+                results.extend(future.result())
             except Exception as e:
                 print(f"   - 에러: ElevenLabs 음성 생성에 실패했습니다. ({e})")
 
+    if not results:
+        print("   - 에러: 생성된 음성이 없어 팟캐스트를 만들 수 없습니다.")
+        return
+
+    # 3단계: 대본 순서대로 타임라인 위치 계산
+    results.sort(key=lambda result: result[0])
+    placements = []
+    previous_end_time = 0
+
+    for i, start_time_ms, speech_segment in results:
+        # 겹침 방지: 이전 대사가 끝나는 시점 이후에 배치
+        adjusted_start_time = max(start_time_ms, previous_end_time + 500)  # 0.5초 간격
+        placements.append((adjusted_start_time, speech_segment))
+        
+        # 다음 대사를 위한 종료 시점 계산
+        previous_end_time = adjusted_start_time + len(speech_segment)
+
+    # 4단계: 모든 대사를 한 번에 믹싱
+    started = time.perf_counter()
+    final_podcast = mix_segments(placements)
+    record_timing("mix_ms", started)
 
     # 최종 팟캐스트 파일 내보내기
-    output_filename = os.path.join(FINAL_PODCAST_PATH, f"{script['title'].replace(' ', '_')}.mp3")
+    safe_title = UNSAFE_FILENAME_PATTERN.sub('_', script['title']).strip('_') or "podcast"
+    output_filename = os.path.join(FINAL_PODCAST_PATH, f"{safe_title}.mp3")
     print(f"\n3. 최종 팟캐스트 파일을 '{output_filename}'으로 저장합니다...")
-    final_podcast.export(output_filename, format="mp3")
+    started = time.perf_counter()
+    export_mp3(final_podcast, output_filename)
+    record_timing("export_ms", started)
     print("   - 팟캐스트 생성 완료!")
 
 
 # --- 메인 실행 ---
 
+def warm_up_connections():
+    """대본 생성 중에 미리 Firebase 토큰을 받고 ElevenLabs 연결을 열어둡니다."""
+    with account_lock:
+        get_firebase_token()
+    try:
+        # 응답 내용과 관계없이 TLS 연결만 세션 풀에 확보
+        SESSION.head("https://api.us.elevenlabs.io", timeout=10)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ ElevenLabs 연결 준비 실패: {e}")
+
 def main():
     """메인 실행 함수"""
+    global profiling_enabled
+    parser = argparse.ArgumentParser(description="상황 설명으로 팟캐스트를 생성합니다.")
+    parser.add_argument("--profile", action="store_true", help=f"단계별 소요 시간과 메모리 사용량을 {PROFILE_LOG_PATH}에 기록")
+    args = parser.parse_args()
+    profiling_enabled = args.profile
+
     # 계정 로드
     if not load_accounts():
         print("❌ 계정 로드 실패. 프로그램을 종료합니다.")
         return
+    load_token_cache()
     
     # 팟캐스트 주제 설정
     situation = """{   "story": "저는 올해 고3을 맞이하는 평범한 학생입니다. 저는 작년 12월에 제 친구가 저랑 같이 찍은 사진을 인스타 스토리에 올렸습니다. 그러고나서 제 친구 여사친이 그 스토리를 보고 저를 소개해달라고 하였습니다. 그렇게 저희는 소개팅이 잡히게 되었고, 그해 겨울 저희는 총 5명(스토리 주인, 원래 여사친 친구, 소개팅녀, 저, 소개팅녀 친구)이서 노래방에서 만나게 되었어요. 우린 서로 되게 낯을 많이 가리는 성격이라 눈을 쳐다보지 못했어요. 근데 친구들의 도움덕에 눈맞춤도 트고, 말도 텄어요. 그렇게 다음 약속을 기약하며 다음엔 단둘이서 만났어요. 그렇게 이제 서로 농담도 던지고 어느정도 친해지면서 (친구)집데이트도 하면서 서로 호감을 확인하고 가까워졌어요. 결국 제가 먼저 밤거리에 걸어가면서 '나랑 사귈래?'라고 했고, 그녀는 알겠다고 했어요. 그렇게 저희는 사귀게 되었지만, 갑자기 데이트한 다음날 그녀가 저를 찼어요. 온 세상이 무너진 기분이 들고 되게 우울해서 친구들과 새벽까지 통화를 하며 울분을 토했지만, 그녀는 돌아오지 않았어요 ㅜㅜㅜㅜㅜ. 2주 사귀고 헤어지게 되었고, 그녀가 제 첫 여친이었어요. 저는 아직도 그녀를 못잊고 가끔은 친구들 앞에서 말도 자주 꺼내면서 살고 있네요.",   "questions": [     {       "question": "그때 그 방의 냄새는 어땠나요? 혹시 특정한 향이 났다면, 그 냄새를 맡았을 때 어떤 느낌이 들었는지 묘사해주실 수 있나요?",       "answer": "친구 방이어서 그저 그랬던 것 같아요. 그래도 친구 침대에서 그녀와 함께 누웠을때 되게 좋았어요."     },     {       "question": "그 사람이 당신에게 했던 말 중에서 정확히 어떤 문장이 가장 기억에 남나요? 그 문장을 다시 한번 말해주실 수 있나요? 그리고 그 문장을 들었을 때, 당신의 즉각적인 반응은 어떠했나요?",       "answer": "말은 아니었지만, 행동으로 제가 손을 잡을때 그녀는 눈을 피했어요. 그때 너무 귀엽더라고요 ㅋ"     },     {       "question": "그 물건을 손에 쥐었을 때 어떤 감촉이었나요? 차가웠나요, 따뜻했나요? 부드러웠나요, 거칠었나요? 그리고 그 물건을 쥐고 있는 동안 어떤 생각이 들었나요?",       "answer": "흥분했어요"     },     {       "question": "그 결정을 내리기 직전, 당신의 머릿속에 어떤 생각들이 스쳐 지나갔나요? 마치 영화의 한 장면처럼, 그 순간의 생각들을 자세히 묘사해주실 수 있나요?",       "answer": "너무 좋아서 빨리 사귀고 싶었죠."     }   ],   "title": "첫사랑 이야기" }"""
+    # Gemini가 대본을 생성하는 동안 인증 및 연결 준비를 백그라운드에서 진행
+    warmup_thread = threading.Thread(target=warm_up_connections, daemon=True)
+    warmup_thread.start()
+
     # 1. 대본 생성
     podcast_script = generate_podcast_script(situation)
+    warmup_thread.join()
 
     # 2. 오디오 생성 및 믹싱
     if podcast_script:
+        if profiling_enabled:
+            tracemalloc.start()
+        started = time.perf_counter()
         create_and_mix_audio(podcast_script)
+        record_timing("audio_total_ms", started)
+        if profiling_enabled:
+            # 오디오 생성/믹싱 중 파이썬 메모리 최대 사용량 (MB)
+            profile_data["audio_peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            tracemalloc.stop()
+
+    if profiling_enabled:
+        write_profile()
 
 if __name__ == "__main__":
     main()
@@ -3,12 +3,32 @@
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import time
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
 import google.generativeai as genai
 from elevenlabs import ElevenLabs, Voice, VoiceSettings
 from pydub import AudioSegment
 from dotenv import load_dotenv
+import cache as story_cache
+
+# orjson이 설치되어 있으면 Gemini 응답 파싱에 사용
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# PyAV가 설치되어 있으면 ffmpeg 프로세스를 띄우지 않고 프로세스 내에서 MP3를 디코딩
+try:
+    import av
+except ImportError:
+    av = None
 
 # --- 설정 (Configuration) ---
 
@@ -36,15 +56,86 @@ SFX_PATH = "sfx"
 GENERATED_AUDIO_PATH = "generated_audio"
 FINAL_PODCAST_PATH = "final_podcast"
 AUTH_FILE_PATH = "auth.txt"
+TOKEN_CACHE_PATH = ".token_cache.json"
+
+# 디버깅용: 생성된 세그먼트 MP3를 GENERATED_AUDIO_PATH에 저장
+DEBUG_SAVE_SEGMENTS = os.getenv("DEBUG_SAVE_SEGMENTS") == "1"
 
 # 계정 로테이션 관련 전역 변수
 accounts = []
 current_account_index = 0
 tts_request_count = 0
 current_token = None
+# 계정별 Firebase 토큰 캐시: {email: [token, 만료 시각(epoch 초)]}
+token_cache = {}
+
+# 여러 TTS 작업 스레드가 계정/토큰 전역 변수를 공유하므로 잠금으로 보호
+account_lock = threading.Lock()
+
+# 동시에 처리할 TTS 요청 수 (ElevenLabs 동시 요청 제한에 맞춰 .env에서 조정 가능)
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "3"))
+
+# 계정당 분당 최대 TTS 요청 수와 계정(이메일)별 최근 요청 시각
+TTS_RPM_LIMIT = 10
+tts_request_times = {}
+
+# 믹싱 샘플레이트 (ElevenLabs MP3 출력과 동일한 44.1kHz mono)
+MIX_SAMPLE_RATE = 44100
+
+# 최종 MP3 인코딩 품질 (LAME VBR, 0=최고 ~ 9=최저)
+EXPORT_MP3_QUALITY = "4"
+
+# Firebase/ElevenLabs 요청이 TCP/TLS 연결을 재사용하도록 세션을 공유
+# 호스트별 연결 수를 작업 스레드 수로 맞춰 필요 이상의 소켓/TLS 연결을 만들지 않음
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TTS_MAX_WORKERS, max_retries=0))
+SESSION.headers["Connection"] = "keep-alive"
+
+# 요청마다 바뀌지 않는 Firebase/ElevenLabs 요청 헤더 (TTS 요청에는 authorization만 추가)
+FIREBASE_HEADERS = {
+    "Referer": "https://elevenlabs.io",
+    "Origin": "https://elevenlabs.io",
+    "Content-Type": "application/json",
+    "User-Agent": "Mozilla/5.0"
+}
+TTS_BASE_HEADERS = {
+    "Accept": "audio/mpeg",
+    "Content-Type": "application/json",
+    "Origin": "https://elevenlabs.io",
+    "Referer": "https://elevenlabs.io/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
+}
+
+# 사연 생성은 가벼운 Flash 모델, 대본 생성은 Pro 모델 사용
+STORY_MODEL_NAME = 'gemini-2.5-flash'
+SCRIPT_MODEL_NAME = 'gemini-2.5-pro'
+
+# 모델 이름별 Gemini 모델 인스턴스 (처음 사용할 때 생성)
+gemini_models = {}
 
 # --- 1. 고민 입력 및 사연 생성 ---
 
+def json_loads(text):
+    """JSON 문자열을 파싱합니다. orjson이 있으면 orjson을 사용합니다."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def extract_json(response_text):
+    """Gemini 응답에서 JSON 부분만 추출합니다."""
+    json_start = response_text.find('{')
+    if json_start != -1:
+        return response_text[json_start:response_text.rfind('}') + 1]
+    # 백틱으로 감싸진 경우 처리
+    return response_text.strip().removeprefix("```json").removesuffix("```").strip()
+
+def get_gemini_model(model_name=SCRIPT_MODEL_NAME):
+    """모델 이름별로 Gemini 모델 인스턴스를 한 번만 생성하여 재사용합니다."""
+    model = gemini_models.get(model_name)
+    if model is None:
+        model = gemini_models[model_name] = genai.GenerativeModel(model_name)
+    return model
+
 def get_user_concern():
     """사용자로부터 고민을 입력받습니다."""
     print("="*50)
@@ -66,7 +157,7 @@ def generate_similar_story(concern):
     print("\n🔍 비슷한 경험을 가진 사례를 찾고 있습니다...")
     
     # Gemini 모델 설정
-    model = genai.GenerativeModel('gemini-2.5-pro')
+    model = get_gemini_model(STORY_MODEL_NAME)
     
     # 사연 생성 프롬프트
     story_prompt = f"""
@@ -93,19 +184,8 @@ def generate_similar_story(concern):
     
     try:
         response = model.generate_content(story_prompt)
-        response_text = response.text.strip()
-        
-        # JSON 부분만 추출 (더 강력한 파싱)
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        
-        if json_start != -1 and json_end != -1:
-            json_text = response_text[json_start:json_end]
-        else:
-            # 백틱으로 감싸진 경우 처리
-            json_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        story_data = json.loads(json_text)
+        json_text = extract_json(response.text)
+        story_data = json_loads(json_text)
         print("✅ 유사 사례 생성 완료.")
         return story_data
     except Exception as e:
@@ -118,7 +198,7 @@ def generate_podcast_script(concern, story_data):
     print("\n🎙️ 상담 팟캐스트 대본을 생성하고 있습니다...")
 
     # Gemini 모델 설정
-    model = genai.GenerativeModel('gemini-2.5-pro')
+    model = get_gemini_model()
 
     # 상담 팟캐스트 대본 생성 프롬프트
     prompt = f"""
@@ -196,19 +276,8 @@ JSON 형식:
 
     try:
         response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # JSON 부분만 추출 (더 강력한 파싱)
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        
-        if json_start != -1 and json_end != -1:
-            json_text = response_text[json_start:json_end]
-        else:
-            # 백틱으로 감싸진 경우 처리
-            json_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        script = json.loads(json_text)
+        json_text = extract_json(response.text)
+        script = json_loads(json_text)
         print("   - 대본 생성 완료.")
         return script
     except Exception as e:
@@ -216,6 +285,123 @@ JSON 형식:
         print(f"   - Gemini 응답 내용: {response.text}")
         return None
 
+def generate_story_and_script(concern):
+    """한 번의 Gemini 요청으로 유사 사연과 상담 팟캐스트 대본을 함께 생성합니다. 실패시 단계별 생성으로 폴백."""
+    print("\n🔍 유사 사례와 상담 팟캐스트 대본을 함께 생성하고 있습니다...")
+
+    # Gemini 모델 설정
+    model = get_gemini_model()
+
+    # 사연과 대본을 한 번에 생성하는 프롬프트
+    prompt = f"""
+당신은 전문 상담사이자 상담 팟캐스트 대본 작가입니다.
+먼저 사용자의 고민을 바탕으로 비슷한 경험을 가진 가상 인물의 사연을 만들고,
+그 사연을 바탕으로 상담 형식의 팟캐스트 대본을 작성해주세요.
+
+사용자의 고민: "{concern}"
+
+[1단계: 사연 요구사항]
+1. 실제로 있을 법한 현실적인 상황을 만들어주세요.
+2. 고민의 핵심 요소를 포함하되, 너무 직접적이지 않게 변형해주세요.
+3. 상황의 배경, 등장인물, 구체적인 상황을 포함해주세요.
+4. 감정적 디테일과 구체적인 에피소드를 포함해주세요.
+5. 해결 과정이나 선택의 기로에 선 상황을 포함해주세요.
+
+사연 형식 (story_data):
+- story: 상세한 사연 (500-800자)
+- person_profile: 인물 소개 (나이, 직업, 상황 등)
+- key_points: 핵심 포인트 3-5개
+- emotions: 주요 감정 상태들
+
+[2단계: 대본 요구사항]
+1. '진행자'(상담사 역할)와 '게스트'(사연 주인공 역할)로 구성해주세요.
+2. 진행자는 공감적이고 전문적인 조언을 제공하는 역할입니다.
+3. 게스트는 1단계에서 만든 사연을 이야기하고 고민을 털어놓는 역할입니다.
+4. 자연스러운 대화 흐름으로 구성해주세요.
+5. 구체적인 조언과 해결 방향을 제시해주세요.
+6. 각 대사에 감정 표현을 대괄호 [] 안에 포함해주세요.
+   - 예시: [empathetic], [thoughtful], [concerned], [supportive], [gentle], [encouraging], [serious], [understanding], [hopeful], [nervous], [relieved], [confident], [grateful], [emotional], [determined]
+7. 시작 시간(start_time)을 초 단위로 명시해주세요.
+8. 3-5분 정도의 분량으로 작성해주세요.
+
+JSON 형식:
+{{
+  "story_data": {{
+    "story": "상세한 사연",
+    "person_profile": "인물 소개",
+    "key_points": ["핵심 포인트"],
+    "emotions": ["감정 상태"]
+  }},
+  "script": {{
+    "title": "팟캐스트 제목",
+    "total_duration_seconds": 240,
+    "segments": [
+      {{
+        "type": "dialogue",
+        "speaker": "진행자",
+        "text": "[gentle] 안녕하세요, 오늘은 특별한 사연을 가지고 오신 분과 함께 이야기 나누어보겠습니다.",
+        "start_time": 2
+      }},
+      {{
+        "type": "dialogue",
+        "speaker": "게스트",
+        "text": "[nervous] 안녕하세요... 사실 이런 이야기 하는 게 처음이라 떨리네요.",
+        "start_time": 8
+      }}
+    ]
+  }}
+}}
+
+주의사항:
+- 감정 표현은 대사의 시작 부분이나 중간에 자연스럽게 배치하세요.
+- 한 대사에 여러 감정을 사용할 수 있지만, 과도하게 사용하지 마세요.
+- 대화의 흐름이 자연스럽게 이어지도록 구성하세요.
+
+**중요: 설명 없이 JSON 형식만 반환하세요. 다른 텍스트는 포함하지 마세요.**
+"""
+
+    try:
+        response = model.generate_content(prompt)
+        json_text = extract_json(response.text)
+        result = json_loads(json_text)
+        story_data = result.get("story_data")
+        script = result.get("script")
+        if story_data and script and script.get("segments"):
+            print("✅ 유사 사례 및 대본 생성 완료.")
+            return story_data, script
+        print("⚠️ 응답에 사연 또는 대본이 없습니다.")
+    except Exception as e:
+        print(f"⚠️ 사연/대본 동시 생성 실패: {e}")
+
+    # 동시 생성에 실패하면 사연 → 대본 순서로 나누어 생성
+    print("   - 단계별 생성으로 다시 시도합니다...")
+    story_data = generate_similar_story(concern)
+    if not story_data:
+        return None, None
+    return story_data, generate_podcast_script(concern, story_data)
+
+def get_story_and_script(concern):
+    """비슷한 고민의 캐시된 사연/대본이 있으면 재사용하고, 없으면 새로 생성하여 캐시에 저장합니다."""
+    try:
+        embedding = story_cache.embed_concern(concern)
+        cached = story_cache.find_similar(embedding)
+    except Exception as e:
+        print(f"⚠️ 사연 캐시 조회 실패: {e}")
+        embedding = cached = None
+
+    if cached:
+        story_data, script, similarity = cached
+        print(f"♻️ 비슷한 고민의 사연과 대본을 재사용합니다. (유사도 {similarity:.2f})")
+        return story_data, script
+
+    story_data, script = generate_story_and_script(concern)
+    if embedding is not None and story_data and script:
+        try:
+            story_cache.save(concern, embedding, story_data, script)
+        except Exception as e:
+            print(f"⚠️ 사연 캐시 저장 실패: {e}")
+    return story_data, script
+
 # --- 2. 계정 관리 시스템 ---
 
 def load_accounts():
@@ -266,17 +452,46 @@ def increment_tts_count():
     tts_request_count += 1
     print(f"📊 현재 계정 TTS 요청 수: {tts_request_count}/2")
 
+def load_token_cache():
+    """디스크에 저장된 Firebase 토큰 캐시를 로드합니다."""
+    global token_cache
+    try:
+        with open(TOKEN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            token_cache = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        token_cache = {}
+
+def save_token_cache():
+    """Firebase 토큰 캐시를 임시 파일에 쓴 뒤 교체하여 원자적으로 저장합니다."""
+    temp_path = f"{TOKEN_CACHE_PATH}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(token_cache, f)
+        os.replace(temp_path, TOKEN_CACHE_PATH)
+    except OSError as e:
+        print(f"⚠️ 토큰 캐시 저장 실패: {e}")
+
 # --- 3. 오디오 생성 및 믹싱 (ElevenLabs & Pydub) ---
 
+# 감정 태그([excited] 등)와 연속 공백 패턴
+EMOTION_TAG_PATTERN = re.compile(r'\[([^\]]+)\]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 안정성 조정에 사용하는 감정 분류
+CREATIVE_EMOTIONS = frozenset({'excited', 'dramatic', 'nervous'})
+ROBUST_EMOTIONS = frozenset({'whispers', 'serious', 'thoughtful'})
+
 def extract_emotion_and_text(text):
     """텍스트에서 감정 태그를 추출하고 깨끗한 텍스트를 반환합니다."""
-    # 감정 태그 패턴 매칭
-    emotion_pattern = r'\[([^\]]+)\]'
-    emotions = re.findall(emotion_pattern, text)
-    
-    # 감정 태그 제거하여 깨끗한 텍스트 생성
-    cleaned_text = re.sub(emotion_pattern, '', text)
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+    emotions = []
+
+    def collect_emotion(match):
+        emotions.append(match.group(1))
+        return ''
+
+    # 감정 태그 수집과 제거를 한 번의 탐색으로 처리
+    cleaned_text = EMOTION_TAG_PATTERN.sub(collect_emotion, text)
+    cleaned_text = WHITESPACE_PATTERN.sub(' ', cleaned_text).strip()
     
     return emotions, cleaned_text
 
@@ -296,6 +511,13 @@ def get_firebase_token():
     
     firebase_email = account['email']
     firebase_password = account['password']
+
+    # 캐시된 토큰이 60초 이상 유효하면 로그인 없이 재사용
+    cached = token_cache.get(firebase_email)
+    if cached and cached[1] - time.time() > 60:
+        current_token = cached[0]
+        return current_token
+
     firebase_api_key = os.getenv("FIREBASE_API_KEY")
     
     if not firebase_api_key:
@@ -304,13 +526,6 @@ def get_firebase_token():
     
     url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={firebase_api_key}"
     
-    headers = {
-        "Referer": "https://elevenlabs.io",
-        "Origin": "https://elevenlabs.io",
-        "Content-Type": "application/json",
-        "User-Agent": "Mozilla/5.0"
-    }
-    
     payload = {
         "email": firebase_email,
         "password": firebase_password,
@@ -323,10 +538,15 @@ def get_firebase_token():
     
     for attempt in range(max_retries):
         try:
-            r = requests.post(url, headers=headers, json=payload)
+            r = SESSION.post(url, headers=FIREBASE_HEADERS, json=payload)
             if r.status_code == 200:
-                token = r.json()['idToken']
+                data = r.json()
+                token = data['idToken']
                 current_token = token
+                # 토큰 유효 시간(기본 1시간)보다 60초 일찍 만료된 것으로 기록
+                expires_in = int(data.get('expiresIn', 3600))
+                token_cache[firebase_email] = [token, time.time() + expires_in - 60]
+                save_token_cache()
                 print(f"✅ Token OK for {firebase_email}")
                 return token
             else:
@@ -343,41 +563,86 @@ def get_firebase_token():
     print(f"❌ Firebase 인증 실패: {max_retries}회 재시도 후 실패")
     return None
 
-def text_to_speech_v3(text, voice_id, emotions=None):
-    """ElevenLabs v3 API를 사용하여 텍스트를 음성으로 변환합니다. 실패시 3초 대기 후 최대 3회 재시도."""
-    global current_token
+def reserve_request_slot(email):
+    """계정의 분당 요청 한도에 맞춰 요청 시각을 예약하고 대기해야 할 시간(초)을 반환합니다. account_lock 안에서 호출해야 합니다."""
+    now = time.monotonic()
+    request_times = tts_request_times.setdefault(email, deque())
+    # 1분이 지난 요청 기록은 제거
+    while request_times and now - request_times[0] >= 60:
+        request_times.popleft()
     
-    # 계정 로테이션 확인
-    if should_rotate_account():
-        rotate_account()
+    wait = 0.0
+    if len(request_times) >= TTS_RPM_LIMIT:
+        wait = max(0.0, 60 - (now - request_times[-TTS_RPM_LIMIT]))
+    request_times.append(now + wait)
+    return wait
+
+def acquire_tts_token():
+    """TTS 요청에 사용할 토큰과 그 계정의 이메일을 배정하고, 계정의 분당 요청 한도를 넘으면 필요한 만큼만 대기합니다."""
+    # 계정 로테이션 확인, 토큰 가져오기, TTS 요청 카운터 증가를 한 번에 처리
+    # 잠금 안에서 처리하므로 동시에 실행되는 작업들도 계정당 2개씩 순서대로 배정됨
+    with account_lock:
+        if should_rotate_account():
+            rotate_account()
+        token = get_firebase_token()
+        if not token:
+            return None, None
+        increment_tts_count()
+        email = get_current_account()['email']
+        wait = reserve_request_slot(email)
     
-    # 토큰 가져오기
-    token = get_firebase_token()
-    if not token:
+    # 대기는 잠금 밖에서 하여 다른 계정의 요청을 막지 않음
+    if wait > 0:
+        print(f"⏳ 분당 요청 한도 도달, {wait:.1f}초 후 요청합니다...")
+        time.sleep(wait)
+    return token, email
+
+def handle_rejected_token(token, rotate):
+    """ElevenLabs가 거부한 토큰을 폐기하고, 필요하면 다음 계정으로 전환합니다. 처리 후 현재 계정의 이메일을 반환합니다."""
+    global current_token
+    with account_lock:
+        # 다른 작업이 이미 토큰을 교체했다면 중복으로 처리하지 않음
+        if current_token == token:
+            if rotate:
+                # 요청 한도/할당량 초과: 토큰은 유효하므로 캐시는 유지하고 계정만 전환
+                rotate_account()
+            else:
+                # 토큰 만료/폐기: 캐시에서도 제거하고 같은 계정으로 다시 로그인
+                token_cache.pop(get_current_account()['email'], None)
+                save_token_cache()
+                current_token = None
+        return get_current_account()['email']
+
+def get_error_status(r):
+    """ElevenLabs 오류 응답 본문의 detail.status 값(예: quota_exceeded)을 반환합니다."""
+    try:
+        detail = r.json().get("detail")
+    except (ValueError, AttributeError):
         return None
-    
+    return detail.get("status") if isinstance(detail, dict) else None
+
+def get_retry_delay(r, default):
+    """Retry-After 헤더가 있으면 그 값(초)을, 없으면 기본 대기 시간을 반환합니다."""
+    try:
+        return max(0, int(r.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+def text_to_speech_v3(text, voice_id, emotions=None):
+    """ElevenLabs v3 API를 사용하여 텍스트를 음성으로 변환합니다.
+    토큰 만료/요청 한도 초과 시 재로그인 또는 계정 전환 후 즉시, 그 외 실패시 15초 대기 후 최대 5회 재시도."""
     url = "https://api.us.elevenlabs.io/v1/text-to-dialogue/stream"
     
     # 감정 정보를 바탕으로 설정 조정 (TTD는 0.0, 0.5, 1.0만 허용)
     stability = 0.5  # Natural (기본값)
     if emotions:
         # 감정에 따라 안정성 조정
-        if any(emotion in ['excited', 'dramatic', 'nervous'] for emotion in emotions):
+        if not CREATIVE_EMOTIONS.isdisjoint(emotions):
             stability = 0.0  # Creative (더 다이나믹한 표현)
-        elif any(emotion in ['whispers', 'serious', 'thoughtful'] for emotion in emotions):
+        elif not ROBUST_EMOTIONS.isdisjoint(emotions):
             stability = 1.0  # Robust (더 안정적인 표현)
     
-    headers = {
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-        "Origin": "https://elevenlabs.io",
-        "Referer": "https://elevenlabs.io/",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-        "authorization": f"Bearer {token}"
-    }
-    
-    # TTS 요청 카운터 증가
-    increment_tts_count()
+    headers = dict(TTS_BASE_HEADERS)
     
     payload = {
         "inputs": [
@@ -396,20 +661,29 @@ def text_to_speech_v3(text, voice_id, emotions=None):
     # 재시도 로직
     max_retries = 5
     retry_delay = 15
+    # 이번 요청에서 할당량 초과/요청 한도로 거부된 계정과 401 후 재로그인한 계정
+    rejected_accounts = set()
+    relogged_in_accounts = set()
     
     for attempt in range(max_retries):
+        # 매 시도마다 토큰을 가져와 로테이션/재로그인 결과를 반영
+        token, email = acquire_tts_token()
+        if not token:
+            return None
+        headers["authorization"] = f"Bearer {token}"
+
         try:
             print(f"🔊 Sending request to ElevenLabs for voice_id: {voice_id}... (attempt {attempt + 1}/{max_retries})")
-            r = requests.post(url, json=payload, headers=headers, stream=True)
+            r = SESSION.post(url, json=payload, headers=headers, stream=True)
             
             if r.status_code == 200:
-                # 스트리밍 응답을 바이트로 수집
-                audio_bytes = b""
-                for chunk in r.iter_content(4096):
+                # 스트리밍 응답을 도착하는 대로 버퍼에 이어 붙임
+                audio_bytes = bytearray()
+                for chunk in r.iter_content(65536):
                     if chunk:
-                        audio_bytes += chunk
+                        audio_bytes.extend(chunk)
                 print("✅ Audio generated successfully")
-                return audio_bytes
+                return bytes(audio_bytes)
             else:
                 print(f"❌ ElevenLabs error [{r.status_code}]:")
                 try:
@@ -417,6 +691,28 @@ def text_to_speech_v3(text, voice_id, emotions=None):
                 except json.JSONDecodeError:
                     print(r.text)
                 
+                # 토큰 만료(401)는 같은 계정으로 다시 로그인한 뒤 대기 없이 재시도
+                # 단, 문자 할당량 소진(quota_exceeded)이나 재로그인 직후의 401은 계정 문제이므로 전환
+                if (r.status_code == 401 and get_error_status(r) != "quota_exceeded"
+                        and email not in relogged_in_accounts):
+                    print(f"🔄 토큰이 거부되어 다시 로그인 후 재시도... ({attempt + 1}/{max_retries})")
+                    handle_rejected_token(token, rotate=False)
+                    relogged_in_accounts.add(email)
+                    continue
+                if r.status_code in (401, 429):
+                    rejected_accounts.add(email)
+                    next_email = handle_rejected_token(token, rotate=True)
+                    # 아직 거부되지 않은 다른 계정으로 넘어갔을 때만 바로 재시도
+                    if next_email not in rejected_accounts:
+                        print(f"🔄 다음 계정으로 즉시 재시도... ({attempt + 1}/{max_retries})")
+                        continue
+                    # 모든 계정이 거부됨: 일시적인 제한이 풀리도록 대기 후 재시도
+                    if attempt < max_retries - 1:
+                        delay = get_retry_delay(r, retry_delay)
+                        print(f"🔄 사용 가능한 계정이 없어 {delay}초 후 재시도... ({attempt + 1}/{max_retries})")
+                        time.sleep(delay)
+                    continue
+                
                 if attempt < max_retries - 1:
                     print(f"🔄 {retry_delay}초 후 재시도... ({attempt + 1}/{max_retries})")
                     time.sleep(retry_delay)
@@ -430,6 +726,71 @@ def text_to_speech_v3(text, voice_id, emotions=None):
     print(f"❌ ElevenLabs API 실패: {max_retries}회 재시도 후 실패")
     return None
 
+def decode_mp3(audio_bytes):
+    """MP3 바이트를 믹싱 포맷(16비트 mono, MIX_SAMPLE_RATE)의 AudioSegment로 디코딩합니다."""
+    if av is None:
+        return AudioSegment.from_file(BytesIO(audio_bytes), format="mp3")
+
+    with av.open(BytesIO(audio_bytes), format="mp3") as container:
+        stream = container.streams.audio[0]
+        # 디코딩하면서 바로 믹싱 포맷으로 변환하여 믹싱 단계의 변환을 생략
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=MIX_SAMPLE_RATE)
+        pcm = bytearray()
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                pcm.extend(resampled.to_ndarray().tobytes())
+        for resampled in resampler.resample(None):
+            pcm.extend(resampled.to_ndarray().tobytes())
+
+    return AudioSegment(
+        data=bytes(pcm),
+        sample_width=2,
+        frame_rate=MIX_SAMPLE_RATE,
+        channels=1
+    )
+
+def mix_segments(placements):
+    """(시작 시간(ms), AudioSegment) 목록을 하나의 numpy 버퍼에 합산하여 믹싱합니다."""
+    # 모든 세그먼트를 16비트 mono 포맷으로 통일
+    tracks = []
+    for start_ms, segment in placements:
+        segment = segment.set_frame_rate(MIX_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+        start = int(start_ms * MIX_SAMPLE_RATE / 1000)
+        tracks.append((start, np.frombuffer(segment.raw_data, dtype=np.int16)))
+
+    # 실제 마지막 대사가 끝나는 지점까지만 버퍼 할당
+    total_samples = max(start + len(samples) for start, samples in tracks)
+    mix = np.zeros(total_samples, dtype=np.int32)
+    for start, samples in tracks:
+        # 누적 버퍼 구간에 직접 더해 임시 배열 생성을 피함
+        window = mix[start:start + len(samples)]
+        np.add(window, samples, out=window)
+
+    # 포화 처리도 제자리에서 수행한 뒤 16비트로 한 번만 변환
+    np.clip(mix, -32768, 32767, out=mix)
+    return AudioSegment(
+        data=mix.astype(np.int16).tobytes(),
+        sample_width=2,
+        frame_rate=MIX_SAMPLE_RATE,
+        channels=1
+    )
+
+def export_mp3(audio, output_filename):
+    """PCM 오디오를 임시 WAV 파일 없이 ffmpeg 표준 입력으로 전달하여 MP3로 인코딩합니다."""
+    command = [
+        AudioSegment.converter, "-y",
+        "-f", f"s{audio.sample_width * 8}le",
+        "-ar", str(audio.frame_rate),
+        "-ac", str(audio.channels),
+        "-i", "pipe:0",
+        "-c:a", "libmp3lame",
+        "-q:a", EXPORT_MP3_QUALITY,
+        output_filename
+    ]
+    result = subprocess.run(command, input=audio.raw_data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 인코딩 실패: {result.stderr.decode('utf-8', errors='replace')}")
+
 def create_and_mix_audio(script):
     """대본을 기반으로 오디오를 생성하고 믹싱합니다."""
     if not script:
@@ -445,26 +806,20 @@ def create_and_mix_audio(script):
         return
 
     # 폴더 생성
-    os.makedirs(GENERATED_AUDIO_PATH, exist_ok=True)
+    if DEBUG_SAVE_SEGMENTS:
+        os.makedirs(GENERATED_AUDIO_PATH, exist_ok=True)
     os.makedirs(FINAL_PODCAST_PATH, exist_ok=True)
 
-    # 최종 팟캐스트를 위한 빈 오디오 세그먼트 생성 (실제 길이는 동적으로 확장)
-    # 프롬프트의 길이 제한은 가이드일 뿐, 실제 오디오는 끊기지 않도록 처리
-    initial_duration_ms = 300000  # 5분으로 넉넉하게 설정
-    final_podcast = AudioSegment.silent(duration=initial_duration_ms)
-
-    # 대본의 각 세그먼트 처리
-    previous_end_time = 0
-    
-    for i, segment in enumerate(script["segments"]):
-        segment_type = segment["type"]
-        start_time_ms = segment["start_time"] * 1000
+    # 1단계: 모든 대사의 음성 생성 요청을 병렬로 제출
+    pending = []
+    with ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as executor:
+        for i, segment in enumerate(script["segments"]):
+            if segment["type"] != "dialogue":
+                continue
 
-        if segment_type == "dialogue":
             speaker = segment["speaker"]
-            original_text = segment["text"]
             # 감정 태그 추출 및 텍스트 정리
-            emotions, cleaned_text = extract_emotion_and_text(original_text)
+            emotions, cleaned_text = extract_emotion_and_text(segment["text"])
             voice_id = VOICE_MAPPING.get(speaker)
             
             if not voice_id:
@@ -472,10 +827,18 @@ def create_and_mix_audio(script):
                 continue
 
             print(f"   - '{speaker}'의 음성을 생성 중... ({i+1}/{len(script['segments'])})")
-            
+            # v3 API 사용하여 감정 표현이 포함된 음성 생성
+            future = executor.submit(text_to_speech_v3, cleaned_text, voice_id, emotions)
+            pending.append((i, segment, speaker, cleaned_text, voice_id, future))
+
+        # 2단계: 대본 순서대로 결과를 받아 타임라인 위치 계산
+        placements = []
+        previous_end_time = 0
+
+        for i, segment, speaker, cleaned_text, voice_id, future in pending:
+            start_time_ms = segment["start_time"] * 1000
             try:
-                # v3 API 사용하여 감정 표현이 포함된 음성 생성
-                audio_bytes = text_to_speech_v3(cleaned_text, voice_id, emotions)
+                audio_bytes = future.result()
                 
                 if not audio_bytes:
                     # v3 API 실패 시 기존 API로 폴백
@@ -492,16 +855,18 @@ def create_and_mix_audio(script):
                     )
                     audio_bytes = b"".join(audio_stream)
                 
-                # 생성된 오디오를 파일로 저장하고 Pydub로 로드
-                segment_filename = os.path.join(GENERATED_AUDIO_PATH, f"segment_{i}_{speaker}.mp3")
-                with open(segment_filename, "wb") as f:
-                    f.write(audio_bytes)
+                # 디버깅 모드에서만 생성된 오디오를 파일로 저장
+                if DEBUG_SAVE_SEGMENTS:
+                    segment_filename = os.path.join(GENERATED_AUDIO_PATH, f"segment_{i}_{speaker}.mp3")
+                    with open(segment_filename, "wb") as f:
+                        f.write(audio_bytes)
                 
-                speech_segment = AudioSegment.from_mp3(segment_filename)
+                # 디스크와 ffmpeg 프로세스를 거치지 않고 메모리에서 바로 디코딩
+                speech_segment = decode_mp3(audio_bytes)
                 
                 # 겹침 방지: 이전 대사가 끝나는 시점 이후에 배치
                 adjusted_start_time = max(start_time_ms, previous_end_time + 500)  # 0.5초 간격
-                final_podcast = final_podcast.overlay(speech_segment, position=adjusted_start_time)
+                placements.append((adjusted_start_time, speech_segment))
                 
                 # 다음 대사를 위한 종료 시점 계산
                 previous_end_time = adjusted_start_time + len(speech_segment)
@@ -509,11 +874,17 @@ def create_and_mix_audio(script):
             except Exception as e:
                 print(f"   - 에러: ElevenLabs 음성 생성에 실패했습니다. ({e})")
 
+    if not placements:
+        print("   - 에러: 생성된 음성이 없어 팟캐스트를 만들 수 없습니다.")
+        return
+
+    # 3단계: 모든 대사를 한 번에 믹싱
+    final_podcast = mix_segments(placements)
 
     # 최종 팟캐스트 파일 내보내기
     output_filename = os.path.join(FINAL_PODCAST_PATH, f"{script['title'].replace(' ', '_')}.mp3")
     print(f"\n3. 최종 팟캐스트 파일을 '{output_filename}'으로 저장합니다...")
-    final_podcast.export(output_filename, format="mp3")
+    export_mp3(final_podcast, output_filename)
     print("   - 팟캐스트 생성 완료!")
 
 
@@ -521,10 +892,18 @@ def create_and_mix_audio(script):
 
 def main():
     """메인 실행 함수"""
+    try:
+        run()
+    finally:
+        SESSION.close()
+
+def run():
+    """고민 입력부터 팟캐스트 생성까지 전체 과정을 실행합니다."""
     # 계정 로드
     if not load_accounts():
         print("❌ 계정 로드 실패. 프로그램을 종료합니다.")
         return
+    load_token_cache()
     
     # 1. 사용자 고민 입력
     concern = get_user_concern()
@@ -532,19 +911,16 @@ def main():
         print("❌ 고민이 입력되지 않았습니다.")
         return
     
-    # 2. 유사 사례 생성
-    story_data = generate_similar_story(concern)
+    # 2. 유사 사례 및 상담 팟캐스트 대본 생성
+    story_data, podcast_script = get_story_and_script(concern)
     if not story_data:
         print("❌ 유사 사례 생성에 실패했습니다.")
         return
-    
-    # 3. 상담 팟캐스트 대본 생성
-    podcast_script = generate_podcast_script(concern, story_data)
     if not podcast_script:
         print("❌ 팟캐스트 대본 생성에 실패했습니다.")
         return
     
-    # 4. 오디오 생성 및 믹싱
+    # 3. 오디오 생성 및 믹싱
     create_and_mix_audio(podcast_script)
 
 if __name__ == "__main__":